@@ -3,35 +3,151 @@ from autogen import AssistantAgent, UserProxyAgent
 import sqlalchemy
 from sqlalchemy import create_engine, text
 import json
+import orjson
 import re
 import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
 from dotenv import load_dotenv
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # Load environment variables first
 load_dotenv()
 
+@st.cache_resource
 def create_engine():
-    """Create database connection engine"""
+    """Create pooled database engine, shared across Streamlit reruns"""
     return sqlalchemy.create_engine(
         f"mysql+mysqlconnector://"
         f"{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-        f"@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+        f"@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}",
+        pool_size=8,
+        max_overflow=4,
+        pool_pre_ping=True,  # Drop connections MySQL closed while idle
+        pool_recycle=3600,
+        connect_args={"connection_timeout": 5}
     )
 
+# Strings, quoted identifiers, optimizer hints (/*+ */) and versioned comments (/*! */)
+# are matched first and kept verbatim; only plain comments and whitespace are normalized.
+# A quote left over after that is never closed, so the text after it can't be tokenized.
+_SQL_TOKEN_RE = re.compile(
+    r"(?P<kept>'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|/\*[+!].*?\*/)"
+    r"|(?P<unclosed>['\"`])"
+    r"|(?:\s|--(?=\s)[^\n]*|#[^\n]*|/\*(?![+!]).*?\*/)+",
+    re.DOTALL,
+)
+# MySQL echoes raw query text in syntax errors; drop it so the error keys on its meaning
+_ERROR_NEAR_RE = re.compile(r" near '.*' at line \d+$", re.DOTALL)
+# Syntax/schema errors that repeat for the same statement until the schema changes
+_DETERMINISTIC_ERRNOS = frozenset({
+    1052,  # Ambiguous column
+    1054,  # Unknown column
+    1064,  # Syntax error
+    1111,  # Invalid use of group function
+    1136,  # Column count doesn't match value count
+    1146,  # Table doesn't exist
+    1222,  # SELECTs with different number of columns
+    1241,  # Operand should contain N column(s)
+    1248,  # Derived table needs an alias
+    1305,  # Function/procedure does not exist
+    1582,  # Incorrect parameter count in native function call
+})
+_DDL_RE = re.compile(r"^\s*(?:ALTER|DROP|CREATE)\b", re.IGNORECASE)
+_JSON_DECODER = json.JSONDecoder()
+
+def _fingerprint(sql: str, context: str = "") -> Optional[str]:
+    """Hash SQL with comments and whitespace normalized away; None if quotes are unbalanced"""
+    parts, pos = [], 0
+    for m in _SQL_TOKEN_RE.finditer(sql):
+        # Text after an unclosed quote may be read as a comment, so distinct statements could collide
+        if m.group("unclosed"):
+            return None
+        parts.append(sql[pos:m.start()])
+        parts.append(m.group("kept") or " ")
+        pos = m.end()
+    parts.append(sql[pos:])
+    normalized = "".join(parts).strip().rstrip(";").strip()
+    return hashlib.md5(f"{normalized}\0{context}".encode()).hexdigest()
+
+def _error_details(exc: Exception) -> tuple:
+    """DBAPI errno and message without SQLAlchemy's [SQL: ...] echo"""
+    orig = getattr(exc, "orig", None) or exc
+    errno = getattr(orig, "errno", None)
+    message = getattr(orig, "msg", None) or str(orig)
+    return errno, _ERROR_NEAR_RE.sub("", message)
+
+class QueryCache:
+    """Thread-safe LRU cache with TTL for debugging results"""
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+@st.cache_resource
+def get_result_caches() -> Dict[str, QueryCache]:
+    """Result caches shared by all sessions; QueryCache is thread-safe"""
+    return {
+        "results": QueryCache(maxsize=1000),
+        "failed_validations": QueryCache(maxsize=1024)
+    }
+
 class DebuggingSession:
     """Optimized session management with token control"""
+    MAX_CONTENT_CHARS = 512
+    KEEP_CHARS = 200  # Head and tail kept when content is compressed
+    RESOLUTION_PHRASES = (
+        "final solution",
+        "error resolved",
+        "successfully executed",
+        "issue fixed"
+    )
+    # One case-insensitive pass instead of lower() plus a scan per phrase
+    _RESOLUTION_RE = re.compile("|".join(map(re.escape, RESOLUTION_PHRASES)), re.IGNORECASE)
+
     def __init__(self, engine):
         self.engine = engine
-        self.history = []
+        self.history = deque(maxlen=3)  # Keep only last 3 interactions to limit context size
         self.current_step = 0
         self.resolved = False
         
     def add_interaction(self, role: str, content: str):
-        # Keep only last 3 interactions to limit context size
-        if len(self.history) >= 3:
-            self.history.pop(0)
         self.history.append({"role": role, "content": content})
+
+    def last_prompt(self) -> str:
+        """Latest interaction as sent to the analyst"""
+        last = self.history[-1]
+        content = last["content"]
+        # Long assistant turns keep only head and tail; errors stay whole since they carry the user's SQL
+        if last["role"] == "assistant" and len(content) > self.MAX_CONTENT_CHARS:
+            content = f"{content[:self.KEEP_CHARS]} [...] {content[-self.KEEP_CHARS:]}"
+        return content
         
     def should_continue(self, last_response: str) -> bool:
         if self.resolved or self.current_step >= 3:
@@ -39,29 +155,29 @@ class DebuggingSession:
         self.current_step += 1
         
         # Check for resolution indicators
-        resolution_phrases = [
-            "final solution",
-            "error resolved",
-            "successfully executed",
-            "issue fixed"
-        ]
-        return not any(phrase in last_response.lower() for phrase in resolution_phrases)
+        return not self._RESOLUTION_RE.search(last_response)
 
 class SQLDebugger:
-    def __init__(self):
-        self.engine = create_engine()
-        self.session = DebuggingSession(self.engine)
-        
-        self.analyst = AssistantAgent(
-            name="SQLAnalyst",
-            system_message="""Analyze SQL errors and provide ONLY JSON responses with:
+    ANALYST_SYSTEM_MESSAGE = """Analyze SQL errors and provide ONLY JSON responses with:
             {
                 "hypothesis": "possible cause",
                 "validation_query": "SQL to test hypothesis",
                 "expected_result": "expected outcome",
                 "solution": "proposed fix"
             }
-            No explanations or markdown. Keep responses minimal.""",
+            No explanations or markdown. Keep responses minimal."""
+    ACTION_KEYS = frozenset({"hypothesis", "validation_query", "expected_result", "solution"})
+
+    def __init__(self):
+        self.engine = create_engine()
+        self.session = DebuggingSession(self.engine)
+        caches = get_result_caches()
+        self.cache = caches["results"]
+        self.failed_validations = caches["failed_validations"]
+        
+        self.analyst = AssistantAgent(
+            name="SQLAnalyst",
+            system_message=self.ANALYST_SYSTEM_MESSAGE,
             llm_config={
                 "config_list": [{
                     "model": "llama-3.3-70b-versatile",
@@ -88,28 +204,63 @@ class SQLDebugger:
         try:
             with self.engine.connect() as conn:
                 result = conn.execute(text(query))
+                self._invalidate_on_ddl(query)
                 return {
                     "success": True,
                     "data": result.fetchmany(3),  # Limit data size
                     "rowcount": result.rowcount
                 }
         except Exception as e:
-            return {"success": False, "error": str(e).split('(Background')[0]}  # Trim verbose errors
+            errno, message = _error_details(e)
+            return {
+                "success": False,
+                "error": str(e).split('(Background')[0],  # Trim verbose errors
+                "errno": errno,
+                "db_message": message
+            }
+
+    def _invalidate_on_ddl(self, query: str):
+        """Drop cached results once the schema may have changed"""
+        if _DDL_RE.match(query):
+            self.cache.clear()
+            self.failed_validations.clear()
 
     def validate_solution(self, solution_query: str) -> Dict[str, Any]:
         """Validate the proposed solution directly"""
+        # Analysts often re-propose a rejected fix; answer those without a DB round-trip.
+        # Non-string solutions skip the cache and fail inside execute_query as before.
+        key = _fingerprint(solution_query) if isinstance(solution_query, str) else None
+        cached = self.failed_validations.get(key) if key is not None else None
+        if cached is not None:
+            return cached
+
         result = self.execute_query(solution_query)
-        return {
+        validation = {
             "valid": result["success"],
             "error": result.get("error"),
             "sample_data": result.get("data")
         }
+        # Only syntax/schema errors are stable; timeouts, deadlocks and data conflicts are not
+        if key is not None and result.get("errno") in _DETERMINISTIC_ERRNOS:
+            self.failed_validations.put(key, validation)
+        return validation
 
     def debug_flow(self, query: str) -> Dict[str, Any]:
         """Optimized debugging flow with token control"""
         initial_result = self.execute_query(query)
         if initial_result["success"]:
             return {"status": "success", "result": initial_result}
+
+        # Same statement failing with the same syntax/schema error resolves the same way
+        cache_key = None
+        if initial_result["errno"] in _DETERMINISTIC_ERRNOS:
+            cache_key = _fingerprint(
+                query, f"{initial_result['errno']}:{initial_result['db_message']}"
+            )
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
             
         self.session.add_interaction("system", f"Error: {initial_result['error']}")
         
@@ -117,7 +268,7 @@ class SQLDebugger:
             try:
                 response = self.user_proxy.initiate_chat(
                     self.analyst,
-                    message=self.session.history[-1]["content"],
+                    message=self.session.last_prompt(),
                     clear_history=True  # Prevent context bloat
                 )
                 last_msg = response.chat_history[-1]["content"]
@@ -132,27 +283,50 @@ class SQLDebugger:
                     validation = self.validate_solution(action["solution"])
                     if validation["valid"]:
                         self.session.resolved = True
-                        return {
+                        result = {
                             "status": "resolved",
                             "solution": action["solution"],
                             "validation": validation
                         }
+                        if cache_key is not None:
+                            self.cache.put(cache_key, result)
+                        return result
                         
-                self.session.add_interaction("assistant", json.dumps(action))
+                self.session.add_interaction("assistant", orjson.dumps(action).decode())
                 
             except Exception as e:
                 break
                 
-        return {"status": "unresolved", "history": self.session.history}
+        return {"status": "unresolved", "history": list(self.session.history)}
 
     def _extract_json(self, response: str) -> Dict[str, Any]:
         """Efficient JSON extraction without regex"""
-        try:
-            start = response.index('{')
-            end = response.rindex('}') + 1
-            return json.loads(response[start:end])
-        except (ValueError, json.JSONDecodeError):
-            return None
+        response = response.strip()
+        # Fast path: the analyst is told to reply with JSON only
+        if response.startswith('{'):
+            try:
+                return orjson.loads(response)
+            except orjson.JSONDecodeError:
+                pass
+
+        # Decode the first balanced object, skipping braces in surrounding prose.
+        # Require an action key so a nested fragment of a malformed reply isn't taken as the answer.
+        start = response.find('{')
+        while start != -1:
+            try:
+                obj, _ = _JSON_DECODER.raw_decode(response, start)
+                if isinstance(obj, dict) and not self.ACTION_KEYS.isdisjoint(obj):
+                    return obj
+            except json.JSONDecodeError:
+                pass
+            start = response.find('{', start + 1)
+        return None
+
+def get_debugger() -> SQLDebugger:
+    """One debugger per browser session, kept across reruns; agents aren't thread-safe to share"""
+    if "debugger" not in st.session_state:
+        st.session_state.debugger = SQLDebugger()
+    return st.session_state.debugger
 
 # Streamlit interface
 def main():
@@ -160,7 +334,8 @@ def main():
     query = st.text_area("Enter SQL query:", height=150)
     
     if st.button("Debug"):
-        debugger = SQLDebugger()
+        debugger = get_debugger()
+        debugger.session = DebuggingSession(debugger.engine)  # Fresh state per click
         result = debugger.debug_flow(query)
         
         st.subheader("Results")